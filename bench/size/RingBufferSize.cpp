@@ -1,5 +1,6 @@
 #include <cstdint>
 #include <cstdio>
+#include <cstring>
 
 #include "spsc/RingBuffer.h"
 #include "mpsc/RingBuffer.h"
@@ -13,16 +14,41 @@ namespace
         uint8_t m_bytes[64];
     };
 
+    bool g_json = false;
+    bool g_firstEntry = true;
+
     template <typename T>
     static void print_sizeof(const char *name)
     {
-        std::printf("%s sizeof=%zu\n", name, sizeof(T));
+        if (g_json)
+        {
+            std::printf("%s\n    \"%s\": %zu", g_firstEntry ? "" : ",", name, sizeof(T));
+            g_firstEntry = false;
+        }
+        else
+        {
+            std::printf("%s sizeof=%zu\n", name, sizeof(T));
+        }
     }
 
 } // namespace
 
-int main()
+// Usage: ouroboros_size [--json]
+int main(int argc, char **argv)
 {
+    for (int i = 1; i < argc; ++i)
+    {
+        if (std::strcmp(argv[i], "--json") == 0)
+        {
+            g_json = true;
+        }
+    }
+
+    if (g_json)
+    {
+        std::printf("{\n  \"sizeof\": {");
+    }
+
     // ── SPSC ─────────────────────────────────────────────────────────────
     {
         using namespace ouroboros::spsc;
@@ -50,5 +76,10 @@ int main()
         print_sizeof<RingBuffer<Payload64, 256>>("spmc::RingBuffer<Payload64,256>");
     }
 
+    if (g_json)
+    {
+        std::printf("\n  }\n}\n");
+    }
+
     return 0;
 }
\ No newline at end of file
@@ -10,23 +10,93 @@ Usage:
   python build.py -b              # build + benchmarks
   python build.py -b --run-size   # build + benchmarks + run size harness
   python build.py -c -t -e -b     # clean build + tests + examples + benchmarks
+  python build.py -f              # build even if nothing changed since the last build
+  python build.py -t -w           # build + test, then rebuild + retest on every change
+  python build.py --force-reconfigure  # drop CMakeCache.txt and re-run cmake configure
 """
 
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
 import shutil
+import statistics
 import subprocess
 import sys
+import time
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 BUILD_DIR = os.path.join(ROOT, "build")
+BENCH_DIR = os.path.join(BUILD_DIR, "bench")
+EXE_SUFFIX = ".exe" if os.name == "nt" else ""
+SIZE_EXE = os.path.join(BENCH_DIR, "ouroboros_size" + EXE_SUFFIX)
+BENCH_EXE = os.path.join(BENCH_DIR, "ouroboros_bench" + EXE_SUFFIX)
+SIZE_REPORT_PATH = os.path.join(BENCH_DIR, "size_report.txt")
+
+# Tool name -> absolute path, filled in by require_tools() so children are
+# started without a PATH search each time.
+TOOLS = {"cmake": "cmake", "ctest": "ctest"}
+
+# Inputs that decide whether a rebuild is needed (see sources_hash()).
+STAMP_FILES = ["CMakeLists.txt", "build.py"]
+STAMP_DIRS = ["inc", "test", "bench", "example"]
+
+WATCH_POLL_S = 0.25
+WATCH_DEBOUNCE_S = 0.1
+
+
+def require_tools(tools):
+    for tool in tools:
+        path = shutil.which(tool)
+        if not path:
+            print(f"error: {tool} not found on PATH")
+            sys.exit(2)
+        TOOLS[tool] = path
+
+
+def size_report_cmd():
+    return [TOOLS["cmake"], "--build", BUILD_DIR, "--target", "ouroboros_size_report"]
+
+
+def spawn(cmd, **kwargs):
+    print(f">>> {' '.join(cmd)}", flush=True)
+    return subprocess.Popen(cmd, **kwargs)
+
+
+def check(proc):
+    if proc.wait() != 0:
+        sys.exit(proc.returncode)
 
 
 def run(cmd, **kwargs):
-    print(f">>> {' '.join(cmd)}")
-    result = subprocess.run(cmd, **kwargs)
-    if result.returncode != 0:
-        sys.exit(result.returncode)
+    proc = spawn(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        text=True,
+        errors="replace",
+        **kwargs,
+    )
+    for line in proc.stdout:
+        # Flush per line: when our stdout is a pipe (CI, tee) Python
+        # block-buffers it, which would hold the log until the child exits.
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    proc.stdout.close()
+
+    check(proc)
+
+
+def jobs():
+    # sched_getaffinity honours cpuset/affinity limits (taskset, cpuset
+    # cgroups) but not CFS quotas such as docker --cpus or cpu.max;
+    # cpu_count() reports every core on the host.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 
 def clean():
@@ -35,155 +105,447 @@ def clean():
         shutil.rmtree(BUILD_DIR)
 
 
-def configure(examples=False, benchmarks=False):
-    os.makedirs(BUILD_DIR, exist_ok=True)
+def cached_options():
+    cache_path = os.path.join(BUILD_DIR, "CMakeCache.txt")
+    if not os.path.isfile(cache_path):
+        return None
+
+    cached = {}
+    with open(cache_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(("#", "//")) or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            name = key.split(":", 1)[0]
+            cached[name] = value
+    return cached
+
+
+def configure_completed(cached):
+    # cmake writes CMakeCache.txt (with the -D values) even when configure
+    # fails, so only trust it once the project and build files exist.
+    if "CMAKE_PROJECT_NAME" not in cached:
+        return False
+
+    generator = cached.get("CMAKE_GENERATOR", "")
+    if generator.startswith("Ninja"):
+        build_file = "build.ninja"
+    elif generator.endswith("Makefiles"):
+        build_file = "Makefile"
+    else:
+        return True
+    return os.path.isfile(os.path.join(BUILD_DIR, build_file))
 
-    cmd = [
-        "cmake",
-        "-B",
-        BUILD_DIR,
-        "-DCMAKE_BUILD_TYPE=Release",
-    ]
 
-    if examples:
-        cmd.append("-DOUROBOROS_BUILD_EXAMPLES=ON")
-    else:
-        cmd.append("-DOUROBOROS_BUILD_EXAMPLES=OFF")
+def drop_cache():
+    cache_path = os.path.join(BUILD_DIR, "CMakeCache.txt")
+    if os.path.isfile(cache_path):
+        print(f"Removing {cache_path}")
+        os.remove(cache_path)
+
+    # CMakeFiles/ holds generator-specific state; cmake refuses to switch
+    # generators while it is present.
+    cmake_files = os.path.join(BUILD_DIR, "CMakeFiles")
+    if os.path.isdir(cmake_files):
+        shutil.rmtree(cmake_files)
+
+
+def default_generator():
+    return "Ninja" if shutil.which("ninja") else None
+
+
+def compiler_launcher():
+    # Returns the sccache/ccache path, "" when OUROBOROS_USE_CCACHE=0 opts
+    # out explicitly, or None to leave any existing launcher setting alone.
+    if os.environ.get("OUROBOROS_USE_CCACHE") == "0":
+        return ""
+    for cache in ("sccache", "ccache"):
+        path = shutil.which(cache)
+        if path:
+            return path
+    return None
 
-    if benchmarks:
-        cmd.append("-DOUROBOROS_BUILD_BENCHMARKS=ON")
-    else:
-        cmd.append("-DOUROBOROS_BUILD_BENCHMARKS=OFF")
+
+def configure(examples=False, benchmarks=False, force=False, generator=None):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+
+    options = {
+        "CMAKE_BUILD_TYPE": "Release",
+        "OUROBOROS_BUILD_EXAMPLES": "ON" if examples else "OFF",
+        "OUROBOROS_BUILD_BENCHMARKS": "ON" if benchmarks else "OFF",
+    }
+
+    # The project is CXX-only, so only the CXX launcher is set.
+    launcher = compiler_launcher()
+    if launcher is not None:
+        options["CMAKE_CXX_COMPILER_LAUNCHER"] = launcher
+
+    cached = cached_options()
+    if cached is not None and generator and cached.get("CMAKE_GENERATOR") != generator:
+        print(f"Generator changed to {generator}, dropping CMake cache")
+        force = True
+
+    if force:
+        drop_cache()
+        cached = None
+
+    if (
+        cached is not None
+        and configure_completed(cached)
+        and all(cached.get(k) == v for k, v in options.items())
+    ):
+        print("CMake cache up to date, skipping configure")
+        return
+
+    cmd = [TOOLS["cmake"]]
+    if generator:
+        cmd += ["-G", generator]
+    cmd += ["-B", BUILD_DIR]
+    cmd += [f"-D{k}={v}" for k, v in options.items()]
 
     run(cmd, cwd=ROOT)
 
 
-def build(examples=False, benchmarks=False):
-    configure(examples=examples, benchmarks=benchmarks)
-    run(["cmake", "--build", BUILD_DIR, f"-j{os.cpu_count()}"], cwd=ROOT)
+def sources_hash(*salt, skip_vendor=False):
+    # Hash path + size + mtime rather than file contents: a stat walk over
+    # the source tree (vendored submodules included) stays well under 100ms.
+    h = hashlib.blake2b(digest_size=16)
+    for part in salt:
+        h.update(f"{part}\0".encode())
+
+    for name in STAMP_FILES:
+        path = os.path.join(ROOT, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            h.update(f"{name}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+
+    for top in STAMP_DIRS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT, top)):
+            skip = {".git", "vendor"} if skip_vendor else {".git"}
+            dirnames[:] = sorted(d for d in dirnames if d not in skip)
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                rel = os.path.relpath(path, ROOT)
+                h.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+
+    return h.hexdigest()
+
+
+def build(examples=False, benchmarks=False, force_reconfigure=False, generator=None, force=False):
+    stamp_path = os.path.join(BUILD_DIR, ".build_stamp")
+    # The launcher is part of the salt so toggling ccache reaches configure().
+    stamp = sources_hash(examples, benchmarks, generator, compiler_launcher())
+
+    if not force and not force_reconfigure and os.path.isfile(stamp_path):
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == stamp:
+                print("Build up to date, skipping configure and build")
+                return
+
+    configure(examples=examples, benchmarks=benchmarks, force=force_reconfigure, generator=generator)
+    run([TOOLS["cmake"], "--build", BUILD_DIR, f"-j{jobs()}"], cwd=ROOT)
+
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(stamp + "\n")
+
+
+def watch(examples=False, benchmarks=False, generator=None, run_tests=False):
+    # Poll the same stat-based digest the build stamp uses, so no third-party
+    # file watcher is needed. The vendored submodules are skipped: they hold
+    # hundreds of files that don't change during an edit-build loop.
+    print(f"\nWatching {', '.join(STAMP_FILES + STAMP_DIRS)} for changes (Ctrl-C to stop)")
+    salt = (examples, benchmarks, generator, compiler_launcher())
+    last = sources_hash(*salt, skip_vendor=True)
+    try:
+        while True:
+            time.sleep(WATCH_POLL_S)
+            current = sources_hash(*salt, skip_vendor=True)
+            if current == last:
+                continue
+
+            # Debounce: wait for editors/formatters to finish writing.
+            while True:
+                time.sleep(WATCH_DEBOUNCE_S)
+                settled = sources_hash(*salt, skip_vendor=True)
+                if settled == current:
+                    break
+                current = settled
+            last = current
+
+            try:
+                build(examples=examples, benchmarks=benchmarks, generator=generator, force=True)
+                if run_tests:
+                    test()
+            except SystemExit as e:
+                # A failed compile or test must not end the watch loop.
+                print(f"*** step failed (exit {e.code}), waiting for changes")
+            else:
+                print("*** ok, waiting for changes")
+    except KeyboardInterrupt:
+        print()
 
 
 def test():
-    run(["ctest", "--test-dir", BUILD_DIR, "--output-on-failure"], cwd=ROOT)
+    run([TOOLS["ctest"], "--test-dir", BUILD_DIR, "--output-on-failure"], cwd=ROOT)
 
 
 def run_size():
-    exe = os.path.join(BUILD_DIR, "bench", "ouroboros_size")
-    if os.name == "nt":
-        exe += ".exe"
+    run([SIZE_EXE], cwd=ROOT)
 
-    run([exe], cwd=ROOT)
 
 def size_report():
-    run(["cmake", "--build", BUILD_DIR, "--target", "ouroboros_size_report"], cwd=ROOT)
+    run(size_report_cmd(), cwd=ROOT)
+    print_size_report()
+
 
-    report_path = os.path.join(BUILD_DIR, "bench", "size_report.txt")
-    if os.path.isfile(report_path):
+def print_size_report():
+    if os.path.isfile(SIZE_REPORT_PATH):
         print("\n--- size_report.txt ---")
-        with open(report_path, "r", encoding="utf-8") as f:
+        with open(SIZE_REPORT_PATH, "r", encoding="utf-8") as f:
             print(f.read())
     else:
-        print(f"error: size report not found at: {report_path}")
+        print(f"error: size report not found at: {SIZE_REPORT_PATH}")
         sys.exit(1)
 
 def run_bench(bench_time_s="0.05s", repetitions=1, out_json=None):
-    exe = os.path.join(BUILD_DIR, "bench", "ouroboros_bench")
-    if os.name == "nt":
-        exe += ".exe"
-
     cmd = [
-        exe,
+        BENCH_EXE,
         f"--benchmark_min_time={bench_time_s}",
         f"--benchmark_repetitions={repetitions}",
     ]
 
     if out_json:
-        cmd.append("--benchmark_format=json")
+        # JSON goes to the file only; the console keeps the readable table.
         cmd.append(f"--benchmark_out={out_json}")
         cmd.append("--benchmark_out_format=json")
 
-        # Suppress JSON dump to console
-        with open(os.devnull, "w") as devnull:
-            run(cmd, cwd=ROOT, stdout=devnull)
-    else:
-        run(cmd, cwd=ROOT)
+    run(cmd, cwd=ROOT)
 
-def collect_metrics(bench_time_s="0.2s", repetitions=1):
-    # 1) sizeof report
-    exe = os.path.join(BUILD_DIR, "bench", "ouroboros_size")
-    if os.name == "nt":
-        exe += ".exe"
+def aggregate_bench(run_paths, out_json):
+    samples = {}
+    time_units = {}
+    context = None
+
+    for path in run_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if context is None:
+            context = data.get("context")
+
+        for bench in data.get("benchmarks", []):
+            # Skip google-benchmark's own mean/median/stddev rows.
+            if bench.get("run_type") == "aggregate":
+                continue
+            name = bench.get("run_name", bench["name"])
+            time_units[name] = bench.get("time_unit", "ns")
+            per_bench = samples.setdefault(name, {})
+            for metric in ("real_time", "cpu_time", "items_per_second", "bytes_per_second"):
+                if metric in bench:
+                    per_bench.setdefault(metric, []).append(bench[metric])
+
+    benchmarks = []
+    for name, metrics in samples.items():
+        stats = {}
+        for metric, vals in metrics.items():
+            vals = sorted(vals)
+            stats[metric] = {
+                "median": statistics.median(vals),
+                "min": vals[0],
+                "max": vals[-1],
+                "p95": vals[int(0.95 * len(vals))],
+                "samples": len(vals),
+            }
+        benchmarks.append({"name": name, "time_unit": time_units[name], "stats": stats})
+
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump({"context": context, "runs": len(run_paths), "benchmarks": benchmarks}, f, indent=2)
+
+    print(f"\nWrote aggregate of {len(run_paths)} runs: {out_json}")
+
+
+def run_bench_repeated(runs, bench_time_s="0.05s", repetitions=1, out_json=None):
+    # Separate processes so each run starts from a cold cache/allocator,
+    # then fold the per-run JSON into median/min/max/p95 per benchmark.
+    runs_dir = os.path.join(BENCH_DIR, "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+
+    run_paths = []
+    for i in range(runs):
+        path = os.path.join(runs_dir, f"run_{i}.json")
+        run_bench(bench_time_s=bench_time_s, repetitions=repetitions, out_json=path)
+        run_paths.append(path)
+
+    if not out_json:
+        out_json = os.path.join(BENCH_DIR, "aggregate.json")
+    aggregate_bench(run_paths, out_json)
+
+
+def parse_size_segments(text):
+    # Berkeley `size` output: a "text data bss dec hex filename" header
+    # followed by one row of values.
+    lines = [ln.split() for ln in text.splitlines() if ln.strip()]
+    for header, values in zip(lines, lines[1:]):
+        if header[:3] == ["text", "data", "bss"]:
+            return {name: int(value) for name, value in zip(header[:3], values[:3])}
+    return None
 
-    sizeof_path = os.path.join(BUILD_DIR, "bench", "sizeof_report.txt")
-    print(f">>> {exe} > {sizeof_path}")
-    with open(sizeof_path, "w", encoding="utf-8") as f:
-        result = subprocess.run([exe], cwd=ROOT, stdout=f)
-        if result.returncode != 0:
-            sys.exit(result.returncode)
 
-    # 2) size segments report (text/data/bss)
-    size_report()
+def collect_metrics(bench_time_s="0.2s", repetitions=1):
+    # The sizeof harness and the size_report target are independent, so
+    # launch both and only wait before reading their outputs. The benchmark
+    # run stays after them: it dominates wall time, and overlapping it with
+    # other work would only perturb the measurements.
+
+    # 1) sizeof report
+    sizeof_json_path = os.path.join(BENCH_DIR, "sizeof.json")
+    with open(sizeof_json_path, "w", encoding="utf-8") as f:
+        sizeof_proc = spawn([SIZE_EXE, "--json"], cwd=ROOT, stdout=f)
+    report_proc = spawn(size_report_cmd(), cwd=ROOT)
+
+    try:
+        check(sizeof_proc)
+        with open(sizeof_json_path, "r", encoding="utf-8") as f:
+            sizeof = json.load(f)["sizeof"]
+
+        # Plain-text copy for the pages generator.
+        sizeof_path = os.path.join(BENCH_DIR, "sizeof_report.txt")
+        with open(sizeof_path, "w", encoding="utf-8") as f:
+            for name, size in sizeof.items():
+                f.write(f"{name} sizeof={size}\n")
+
+        # 2) size segments report (text/data/bss)
+        check(report_proc)
+    finally:
+        # Never leave the cmake build running behind us if we bail out early.
+        report_proc.wait()
+    print_size_report()
+
+    with open(SIZE_REPORT_PATH, "r", encoding="utf-8") as f:
+        segments = parse_size_segments(f.read())
 
     # 3) benchmarks json
-    results_path = os.path.join(BUILD_DIR, "bench", "results.json")
+    results_path = os.path.join(BENCH_DIR, "results.json")
     run_bench(bench_time_s=bench_time_s, repetitions=repetitions, out_json=results_path)
+    with open(results_path, "r", encoding="utf-8") as f:
+        benchmarks = json.load(f)
+
+    metrics_path = os.path.join(BENCH_DIR, "metrics.json")
+    with open(metrics_path, "w", encoding="utf-8") as f:
+        json.dump({"sizeof": sizeof, "segments": segments, "benchmarks": benchmarks}, f, indent=2)
 
     print("\nWrote:")
+    print(f"  {metrics_path}")
+    print(f"  {sizeof_json_path}")
     print(f"  {sizeof_path}")
-    print(f"  {os.path.join(BUILD_DIR, 'bench', 'size_report.txt')}")
-    print(f"  {os.path.join(BUILD_DIR, 'bench', 'ouroboros_size.map')}")
+    print(f"  {SIZE_REPORT_PATH}")
+    print(f"  {os.path.join(BENCH_DIR, 'ouroboros_size.map')}")
     print(f"  {results_path}")
 
 
+def run_parallel(tasks):
+    if len(tasks) <= 1:
+        for task in tasks:
+            task()
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = [pool.submit(task) for task in tasks]
+        for future in futures:
+            # Re-raises SystemExit from a failed run() in the worker.
+            future.result()
+
+
 def main():
     parser = argparse.ArgumentParser(description="Build ouroboros")
     parser.add_argument("-c", "--clean", action="store_true", help="clean before building")
     parser.add_argument("-t", "--test", action="store_true", help="run tests after building")
     parser.add_argument("-e", "--examples", action="store_true", help="build examples")
     parser.add_argument("-b", "--benchmarks", action="store_true", help="build benchmarks")
+    parser.add_argument("-f", "--force", action="store_true", help="configure and build even if sources are unchanged since the last build")
+    parser.add_argument("--force-reconfigure", action="store_true", help="delete CMakeCache.txt and re-run cmake configure")
+    parser.add_argument("-G", "--generator", default=None, help="cmake generator (default: Ninja if found on PATH, else the cmake default)")
+    parser.add_argument("-w", "--watch", action="store_true", help="after building, rebuild (and re-run tests with -t) whenever sources change")
     parser.add_argument("--run-size", action="store_true", help="run size harness (requires -b)")
     parser.add_argument("--size-report", action="store_true", help="generate and print code/ram size report (requires -b)")
     parser.add_argument("--run-bench", action="store_true", help="run benchmarks after building (requires -b)")
     parser.add_argument("--bench-time", default="0.05s", help="google-benchmark min time (use seconds suffix, e.g. 0.05s, 0.2s, 1s)")
     parser.add_argument("--bench-reps", type=int, default=1, help="google-benchmark repetitions")
+    parser.add_argument("--bench-runs", type=int, default=1, help="run the benchmark binary N times and write median/min/max/p95 to build/bench/aggregate.json (or --bench-out)")
     parser.add_argument("--bench-out", default="", help="write benchmark json to this path (requires --run-bench)")
-    parser.add_argument("--collect-metrics", action="store_true", help="write sizeof_report.txt + size_report.txt (+ map) (requires -b)")
+    parser.add_argument("--collect-metrics", action="store_true", help="write metrics.json + sizeof_report.txt + size_report.txt (+ map) (requires -b)")
 
     args = parser.parse_args()
 
-    if args.clean:
-        clean()
+    for flag, enabled in (
+        ("--run-size", args.run_size),
+        ("--size-report", args.size_report),
+        ("--run-bench", args.run_bench),
+        ("--collect-metrics", args.collect_metrics),
+    ):
+        if enabled and not args.benchmarks:
+            print(f"error: {flag} requires -b/--benchmarks")
+            sys.exit(2)
 
-    build(examples=args.examples, benchmarks=args.benchmarks)
+    generator = args.generator if args.generator else default_generator()
 
+    # Check up front so a missing tool doesn't surface as a traceback
+    # after clean/configure have already run.
+    tools = ["cmake"]
     if args.test:
-        test()
+        tools.append("ctest")
+    if generator == "Ninja":
+        tools.append("ninja")
+    require_tools(tools)
 
-    if args.run_size:
-        if not args.benchmarks:
-            print("error: --run-size requires -b/--benchmarks")
-            sys.exit(2)
-        run_size()
+    if args.clean:
+        clean()
+
+    build(
+        examples=args.examples,
+        benchmarks=args.benchmarks,
+        force_reconfigure=args.force_reconfigure,
+        generator=generator,
+        force=args.force,
+    )
 
+    # size_report() and collect_metrics() both drive the
+    # ouroboros_size_report cmake target, so they must not overlap.
     if args.size_report:
-        if not args.benchmarks:
-            print("error: --size-report requires -b/--benchmarks")
-            sys.exit(2)
         size_report()
 
-    if args.run_bench:
-        if not args.benchmarks:
-            print("error: --run-bench requires -b/--benchmarks")
-            sys.exit(2)
+    if args.collect_metrics:
+        collect_metrics(bench_time_s=args.bench_time, repetitions=args.bench_reps)
 
+    tasks = []
+    if args.test:
+        tasks.append(test)
+    if args.run_size:
+        tasks.append(run_size)
+    run_parallel(tasks)
+
+    # Benchmarks run last and alone so other steps don't skew the timings.
+    if args.run_bench:
         out_json = args.bench_out if args.bench_out else None
-        run_bench(bench_time_s=args.bench_time, repetitions=args.bench_reps, out_json=out_json)
+        if args.bench_runs > 1:
+            run_bench_repeated(
+                args.bench_runs,
+                bench_time_s=args.bench_time,
+                repetitions=args.bench_reps,
+                out_json=out_json,
+            )
+        else:
+            run_bench(bench_time_s=args.bench_time, repetitions=args.bench_reps, out_json=out_json)
+
+    if args.watch:
+        watch(
+            examples=args.examples,
+            benchmarks=args.benchmarks,
+            generator=generator,
+            run_tests=args.test,
+        )
 
-    if args.collect_metrics:
-        if not args.benchmarks:
-            print("error: --collect-metrics requires -b/--benchmarks")
-            sys.exit(2)
-        collect_metrics(bench_time_s=args.bench_time, repetitions=args.bench_reps)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file